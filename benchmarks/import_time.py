@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+# Measure the time needed to import infupy modules in a fresh interpreter.
+# Usage: python benchmarks/import_time.py [module ...]
+
+import sys, subprocess, time
+
+MODULES = ['infupy', 'infupy.backends', 'infupy.backends.fresenius',
+           'infupy.backends.alaris', 'infupy.record']
+REPEAT = 10
+
+def importTime(module, repeat=REPEAT):
+    # Best of repeat, minus the bare interpreter startup
+    def best(code):
+        times = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], check=True,
+                           stderr=subprocess.DEVNULL)
+            times.append(time.perf_counter() - t)
+        return min(times)
+    return best('import {}'.format(module)) - best('pass')
+
+def main(modules):
+    for module in modules:
+        try:
+            t = importTime(module)
+        except subprocess.CalledProcessError:
+            print("{:30} failed".format(module))
+        else:
+            print("{:30} {:8.1f} ms".format(module, t * 1e3))
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or MODULES)
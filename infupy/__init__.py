@@ -1 +1,6 @@
-__all__ = ["backends", "gui"]
+__all__ = ["backends", "gui", "record", "flow"]
+
+def open(kind, port, **kwargs):
+    # Open a communication port with the given backend, e.g. open('fresenius', 'COM1')
+    from infupy.backends import openComm
+    return openComm(kind, port, **kwargs)
@@ -1 +1,25 @@
-__all__ = ['common', 'fresenius', 'alaris']
+import importlib
+
+__all__ = ['common', 'history', 'fresenius', 'alaris']
+
+# Backend kind -> (module, communication class)
+# Modules are only imported when a backend is first used.
+BACKENDS = {
+    'fresenius' : ('infupy.backends.fresenius', 'FreseniusComm'),
+    'alaris'    : ('infupy.backends.alaris',    'AlarisComm')
+}
+
+def register(kind, module, commclass):
+    BACKENDS[kind] = (module, commclass)
+
+def load(kind):
+    try:
+        module, _ = BACKENDS[kind]
+    except KeyError:
+        raise ValueError("Unknown backend: {}".format(kind))
+    return importlib.import_module(module)
+
+def openComm(kind, port, **kwargs):
+    backend = load(kind)
+    _, commclass = BACKENDS[kind]
+    return getattr(backend, commclass)(port, **kwargs)
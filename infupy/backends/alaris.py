@@ -4,14 +4,18 @@ import queue
 from enum import Enum, auto
 
 import serial
-import crcmod
 
 from infupy.backends.common import Syringe, CommandError, printerr
 
 DEBUG = False
 
-crcccitt = crcmod.predefined.mkCrcFun('crc-ccitt-false')
+# Built on first use, crcmod is only needed once we talk to a pump.
+crcccitt = None
 def genCheckSum(msg):
+    global crcccitt
+    if crcccitt is None:
+        import crcmod.predefined
+        crcccitt = crcmod.predefined.mkCrcFun('crc-ccitt-false')
     crcval = crcccitt(msg)
     return b'%04X' % crcval
 
@@ -10,7 +10,9 @@ class CommandError(Exception):
         return "Command error: {}".format(self.args)
 
 class Syringe(metaclass=ABCMeta):
-    _events = set()
+    def __init__(self):
+        # Events the caller wants reported, per syringe instance
+        self._events = set()
 
     @abstractmethod
     def execCommand(self, msg):
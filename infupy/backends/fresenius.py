@@ -3,14 +3,21 @@ import queue
 import time
 
 from enum import Enum, unique
-from datetime import datetime
+from collections import namedtuple
 
 import serial
 
 from infupy.backends.common import Syringe, CommandError, printerr
+from infupy.backends.history import History
 
 DEBUG = False
 
+# Seconds of silence after which a module gets probed actively
+SILENCE_TIMEOUT = 5
+
+# Seconds during which a reply missing from a batch is expected to show up late
+LATE_REPLY_TIMEOUT = 5
+
 def genCheckSum(msg):
     asciisum = sum(msg)
     _, low = divmod(asciisum, 0x100)
@@ -61,31 +68,68 @@ def parseVars(msg):
         ret[ident] = value
     return ret
 
+def decodeVar(ident, value):
+    n = int(value, 16)
+    if ident in VARdecimals:
+        decimals = VARdecimals[ident]
+        return round(n * 10 ** -decimals, decimals)
+    return n
+
+def encodeVar(ident, value):
+    if ident in VARdecimals:
+        value = round(value * 10 ** VARdecimals[ident])
+    return b'%X' % int(value)
+
+def decodeVars(msg):
+    ret = {}
+    for ident, value in parseVars(msg).items():
+        try:
+            ret[ident] = decodeVar(ident, value)
+        except ValueError:
+            printerr("Failed to decode variable {}", ident)
+    return ret
+
 def extractRate(msg):
     vals = parseVars(msg)
     if VarId.rate not in vals.keys():
         raise ValueError
-    rate = vals[VarId.rate]
-    n = int(rate, 16)
-    return round(n * 1e-1, 1)
+    return decodeVar(VarId.rate, vals[VarId.rate])
 
 def extractVolume(msg):
     vals = parseVars(msg)
     if VarId.volume not in vals.keys():
         raise ValueError
-    vol = vals[VarId.volume]
-    n = int(vol, 16)
-    return round(n * 1e-3, 3)
+    return decodeVar(VarId.volume, vals[VarId.volume])
+
+def genCommand(command, flags=[], args=[]):
+    if len(flags) > 0:
+        flagvals = [f.value for f in flags]
+        flagbytes = b''.join(flagvals)
+        return command.value + b';' + flagbytes
+    elif len(args) > 0:
+        argbytes = b';'.join(args)
+        return command.value + b';' + argbytes
+    else:
+        return command.value
+
+def sortFlags(flags):
+    return sorted(flags, key=lambda f: f.value)
 
 class FreseniusModule(Syringe):
-    def __init__(self, comm, index=None):
+    def __init__(self, comm, index=None, autoconnect=True):
         super().__init__()
         self.comm = comm
         if index is None:
             # Standalone syringe
             index = b''
         self._index = index if isinstance(index, bytes) else str(index).encode('ASCII')
-        self.connect()
+        # Events the module has acknowledged as registered
+        self._spontevents = set()
+        # Adjusted variable events, wanted and acknowledged
+        self._adjevents = set()
+        self._spontadjevents = set()
+        if autoconnect:
+            self.connect()
 
     def execRawCommand(self, msg, retry=True):
         def qTimeout():
@@ -103,8 +147,10 @@ class FreseniusModule(Syringe):
 
         reply = self.comm.recvq.get()
         if reply.error and reply.value is Error.ECOMMODULE:
+            # The module got reset. Reconnect and restore its event registrations.
             printerr("Error: {}. Lost connection. Trying to reconnect.", reply.value)
             self.connect()
+            self.syncEvents()
             return self.execRawCommand(msg, retry=False)
         elif reply.error and retry and reply.value in [Error.ERNR, Error.ETIMEOUT]:
             # Temporary error. Try once more
@@ -114,21 +160,18 @@ class FreseniusModule(Syringe):
             return reply
 
     def execCommand(self, command, flags=[], args=[]):
-        if len(flags) > 0:
-            flagvals = [f.value for f in flags]
-            flagbytes = b''.join(flagvals)
-            commandraw = command.value + b';' + flagbytes
-        elif len(args) > 0:
-            argbytes = b';'.join(args)
-            commandraw = command.value + b';' + argbytes
-        else:
-            commandraw = command.value
-        return self.execRawCommand(commandraw)
+        return self.execRawCommand(genCommand(command, flags, args))
 
     def connect(self):
         reply = self.execCommand(Command.connect)
+        return self._connected(reply)
+
+    def _connected(self, reply):
         if reply.error:
             raise CommandError(reply.value)
+        # A new session starts without any registered events
+        self._spontevents = set()
+        self._spontadjevents = set()
         return reply.value
 
     def disconnect(self):
@@ -140,27 +183,82 @@ class FreseniusModule(Syringe):
             raise CommandError(reply.value)
         return reply.value
 
+    # Liveness tracking
+    def lastSeen(self):
+        # Monotonic time of the last frame received from this module
+        return self.comm.lastSeen(self.index)
+
+    def isAlive(self, timeout=SILENCE_TIMEOUT):
+        seen = self.lastSeen()
+        return seen is not None and time.monotonic() - seen < timeout
+
+    def checkAlive(self, timeout=SILENCE_TIMEOUT):
+        # Only probe the module if it has been silent for too long.
+        if not self.isAlive(timeout):
+            self.readDeviceType()
+
     # Spontaneous variable handling
     def registerEvent(self, event):
         super().registerEvent(event)
-        reply = self.execCommand(Command.enspont, flags=self._events)
-        if reply.error:
-            raise CommandError(reply.value)
+        self.syncEvents()
 
     def unregisterEvent(self, event):
         super().unregisterEvent(event)
+        self.syncEvents()
+
+    def clearEvents(self):
+        super().clearEvents()
+        # Always send, the module may hold registrations from a former session.
         reply = self.execCommand(Command.disspont)
         if reply.error:
             raise CommandError(reply.value)
-        reply = self.execCommand(Command.enspont, flags=self._events)
+        self._spontevents = set()
+
+    # Adjusted variables are pushed by the module whenever they get changed
+    def registerAdjEvent(self, event):
+        self._adjevents |= set([event])
+        self.syncEvents()
+
+    def unregisterAdjEvent(self, event):
+        self._adjevents -= set([event])
+        self.syncEvents()
+
+    def clearAdjEvents(self):
+        self._adjevents = set()
+        reply = self.execCommand(Command.disspontadj)
         if reply.error:
             raise CommandError(reply.value)
+        self._spontadjevents = set()
 
-    def clearEvents(self):
-        super().clearEvents()
-        reply = self.execCommand(Command.disspont)
+    def readAdjVars(self, varids):
+        reply = self.execCommand(Command.readadj, flags=sortFlags(varids))
         if reply.error:
             raise CommandError(reply.value)
+        return decodeVars(reply.value)
+
+    def syncEvents(self):
+        # Only talk to the module if the registrations differ from what we want.
+        self._spontevents = self.__syncSpont(self._events, self._spontevents,
+                                             Command.enspont, Command.disspont)
+        self._spontadjevents = self.__syncSpont(self._adjevents, self._spontadjevents,
+                                                Command.enspontadj, Command.disspontadj)
+
+    def __syncSpont(self, wanted, registered, encmd, discmd):
+        if wanted == registered:
+            return registered
+        if registered - wanted:
+            # Registrations can only be dropped all at once
+            reply = self.execCommand(discmd)
+            if reply.error:
+                raise CommandError(reply.value)
+            registered = set()
+        if wanted:
+            events = set(wanted)
+            reply = self.execCommand(encmd, flags=sortFlags(events))
+            if reply.error:
+                raise CommandError(reply.value)
+            registered = events
+        return registered
 
     @property
     def index(self):
@@ -173,16 +271,96 @@ class FreseniusModule(Syringe):
 
 class FreseniusBase(FreseniusModule):
     def __init__(self, comm, wait=True):
+        # The connect reply is the readiness signal of the base, no delay
+        # is needed afterwards. wait is kept for compatibility and unused.
         super().__init__(comm, 0)
         self.syringes = {}
-        if wait:
-            time.sleep(1)
 
     def connectSyringe(self, index):
         s = FreseniusSyringe(self.comm, index)
         self.syringes[index] = s
         return s
 
+    def connectSyringes(self, indices, events=[]):
+        # Connect and register several modules with overlapping commands.
+        # Modules which fail are retried one by one with the usual error handling.
+        new = [FreseniusSyringe(self.comm, i, autoconnect=False) for i in indices]
+
+        connected = []
+        replies = self.execParallel(new, Command.connect)
+        for s in new:
+            reply, _ = replies[s.index]
+            try:
+                if reply.error:
+                    s.connect()
+                else:
+                    s._connected(reply)
+            except CommandError as e:
+                printerr("Failed to connect module {}: {{}}".format(s.index), e)
+            else:
+                connected.append(s)
+
+        for s in connected:
+            s._events |= set(events)
+        if events:
+            replies = self.execParallel(connected, Command.enspont, flags=sortFlags(events))
+            for s in connected:
+                reply, _ = replies[s.index]
+                if not reply.error:
+                    s._spontevents = set(events)
+
+        ret = {}
+        for s in connected:
+            try:
+                s.syncEvents()
+            except CommandError as e:
+                printerr("Failed to register events on module {}: {{}}".format(s.index), e)
+            self.syringes[s.index] = s
+            ret[s.index] = s
+        return ret
+
+    def connectAll(self, events=[]):
+        return self.connectSyringes(self.listModules(), events)
+
+    def stopAll(self, timeout=1, rounds=2):
+        # Pause all connected syringes with back to back frames. Modules
+        # which did not acknowledge are sent the frame again, all together,
+        # for at most `rounds` rounds of `timeout` seconds each.
+        # Only positively acknowledged modules are confirmed.
+        # Returns {index: StopResult}, latencies in seconds since the first frame.
+        modules = list(self.syringes.values())
+        sent = time.monotonic()
+        results = {}
+        for _ in range(rounds):
+            if not modules:
+                break
+            replies = self.execParallel(modules, Command.setpause, timeout=timeout)
+            failed = []
+            for m in modules:
+                reply, received = replies[m.index]
+                if reply.error:
+                    results[m.index] = StopResult(False, None, reply.value)
+                    failed.append(m)
+                else:
+                    results[m.index] = StopResult(True, received - sent, None)
+            modules = failed
+        return results
+
+    def execParallel(self, modules, command, flags=[], args=[], timeout=1):
+        # Send the same command to several modules back to back.
+        # Returns the (reply, monotonic time of reception) pairs indexed by
+        # module, modules which did not answer in time get an ETIMEOUT reply.
+        msg = genCommand(command, flags, args)
+        frames = {m.index: genFrame(m._index, msg) for m in modules}
+        replies = self.comm.execRawBatch(frames, timeout)
+        return {m.index: replies.get(m.index, (Reply(m.index, Error.ETIMEOUT, error=True), None))
+                for m in modules}
+
+    def lastSeen(self):
+        # Keep-alives are sent by the base
+        seen = [t for t in (super().lastSeen(), self.comm.lastlink) if t is not None]
+        return max(seen) if seen else None
+
     def listModules(self):
         reply = self.execCommand(Command.readvar, flags=[VarId.modules])
         if reply.error:
@@ -211,6 +389,12 @@ class FreseniusSyringe(FreseniusModule):
             raise CommandError(reply.value)
         return extractVolume(reply.value)
 
+    def setRate(self, rate):
+        # Same fixed point encoding as readRate
+        reply = self.execCommand(Command.setrate, args=[encodeVar(VarId.rate, rate)])
+        if reply.error:
+            raise CommandError(reply.value)
+
     def readDrug(self):
         reply = self.execCommand(Command.readdrug)
         if reply.error:
@@ -235,6 +419,30 @@ class FreseniusSyringe(FreseniusModule):
             raise CommandError(reply.value)
 
 
+def openBase(port, events=[]):
+    # Open the port, connect the base and all of its modules in one go.
+    comm = FreseniusComm(port)
+    base = FreseniusBase(comm)
+    base.connectAll(events)
+    return base
+
+
+def stopAll(bases, timeout=1):
+    # Stop the syringes of several bases, one thread per port.
+    # Returns {(port, index): StopResult}.
+    results = {}
+    def stopBase(base):
+        for index, result in base.stopAll(timeout).items():
+            results[(base.comm.port, index)] = result
+
+    threads = [threading.Thread(target=stopBase, args=(base,)) for base in bases]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
 class FreseniusComm(serial.Serial):
     def __init__(self, port):
         # These settings come from Fresenius documentation
@@ -247,9 +455,27 @@ class FreseniusComm(serial.Serial):
             self.logrx = open('fresenius_rx.log', 'wb', buffering=0)
             self.logtx = open('fresenius_tx.log', 'wb', buffering=0)
 
-        self.recvq  = queue.LifoQueue()
-        self.cmdq   = queue.Queue(maxsize=10)
-        self.eventq = queue.Queue(maxsize=1e4)
+        self.recvq     = queue.LifoQueue()
+        self.cmdq      = queue.Queue(maxsize=10)
+        self.eventq    = queue.Queue(maxsize=1e4)
+        self.adjeventq = queue.Queue(maxsize=1e4)
+
+        # Monotonic time of the last frame per origin and of the last keep-alive
+        self.lastseen = {}
+        self.lastlink = None
+
+        # Origins whose batch reply is overdue, with the time to stop waiting
+        self.__latereplies = {}
+        self.__latelock = threading.Lock()
+
+        # Wall clock anchor for monotonic timestamps, taken once so that
+        # wall clock jumps do not show up in the event timestamps.
+        self.clockanchor = time.time_ns() - time.monotonic_ns()
+
+        # Recent decoded event values per module and variable
+        self.history = History()
+        # Events dropped from full event queues
+        self.droppedevents = 0
 
         # Write lock to make sure only one source writes at a time
         self.__rxthread = RecvThread(self)
@@ -280,23 +506,104 @@ class FreseniusComm(serial.Serial):
         except ValueError as e:
             printerr("State machine got confused: {}", e)
 
+    def execRawBatch(self, frames, timeout=1):
+        # Write frames given as {origin: frame} at once and collect the replies.
+        # Replies arrive in any order and are matched by origin.
+        # Returns {origin: (reply, monotonic time of reception)} for the
+        # modules which answered before the deadline.
+        for frame in frames.values():
+            self.cmdq.put(frame)
+
+        pending = set(frames)
+        replies = {}
+        unattributed = 0
+        deadline = time.monotonic() + timeout
+        while pending:
+            remaining = max(deadline - time.monotonic(), 0)
+            try:
+                reply = self.recvq.get(timeout=remaining)
+            except queue.Empty:
+                break
+            received = time.monotonic() if reply.rxtime is None else reply.rxtime * 1e-9
+            if reply.origin in pending and reply.rxtime is not None:
+                pending.remove(reply.origin)
+                replies[reply.origin] = (reply, received)
+            elif reply.error and reply.rxtime is None:
+                # Link layer error (NAK) of one of the frames, origin unknown
+                unattributed += 1
+            else:
+                printerr("Unexpected reply in batch: {}", reply)
+
+        if pending:
+            # Replies which come after the deadline must neither release
+            # a command slot again nor be taken for the reply of a later command.
+            self.expectLateReplies(pending)
+            for _ in range(max(len(pending) - unattributed, 0)):
+                self.allowNewCmd()
+        return replies
+
+    def expectLateReplies(self, origins):
+        expiry = time.monotonic() + LATE_REPLY_TIMEOUT
+        with self.__latelock:
+            for origin in origins:
+                self.__latereplies[origin] = expiry
+
+    def discardLateReply(self, origin):
+        # True if the reply from origin belongs to a batch which timed out
+        with self.__latelock:
+            expiry = self.__latereplies.pop(origin, None)
+        return expiry is not None and time.monotonic() < expiry
+
+    def markSeen(self, origin):
+        self.lastseen[origin] = time.monotonic()
+
+    def markLink(self):
+        self.lastlink = time.monotonic()
+
+    def wallTime(self, rxtime):
+        # Wall clock time in ns since the epoch for a monotonic time in ns
+        return rxtime + self.clockanchor
+
+    def lastSeen(self, index):
+        return self.lastseen.get(index)
+
 
 class RecvThread(threading.Thread):
     def __init__(self, comm):
         super().__init__(daemon=True)
         self.comm = comm
         self.__buffer = b''
+        # Monotonic time in ns at which the current frame started
+        self.__rxtime = None
 
     def acknowledgeEvent(self, origin, status):
         self.comm.cmdq.put(genFrame(origin, status.value))
         self.comm.allowNewCmd()
 
+    def enqueueEvent(self, q, event):
+        # Never block the receive thread on a full event queue, as it must
+        # keep acknowledging frames. Drop the oldest event instead.
+        # Drops are counted on the comm and only the first one is reported.
+        while True:
+            try:
+                q.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    continue
+                if not self.comm.droppedevents:
+                    printerr("Event queue full, dropping oldest events. Nobody reads it?")
+                self.comm.droppedevents += 1
+
     def enqueueReply(self, reply):
         self.comm.recvq.put(reply)
         self.comm.allowNewCmd()
 
     def processRxBuffer(self):
         status, origin, msg, chk = parseReply(self.__buffer)
+        rxtime = self.__rxtime
         self.__buffer = b''
         if chk:
             # Send ACK
@@ -309,18 +616,32 @@ class RecvThread(threading.Thread):
             self.comm.allowNewCmd()
             return
 
+        if status is not ReplyStatus.incorrect:
+            # Error replies may come from the base on behalf of an
+            # unreachable module, they are no sign of life.
+            if origin is not None and origin.isdigit():
+                self.comm.markSeen(int(origin))
+            else:
+                self.comm.markSeen(None)
+
+        if status in (ReplyStatus.correct, ReplyStatus.incorrect):
+            iorigin = int(origin) if origin is not None and origin.isdigit() else 0
+            if self.comm.discardLateReply(iorigin):
+                printerr("Discarding late reply from module {}", iorigin)
+                return
+
         if status is ReplyStatus.incorrect:
             # Error condition
             try:
                 error = Error(msg)
             except ValueError:
                 error = Error.EUNDEF
-            self.enqueueReply(Reply(origin, error, error=True))
+            self.enqueueReply(Reply(origin, error, error=True, rxtime=rxtime))
             printerr("Command error: {}", error)
 
         elif status is ReplyStatus.correct:
             # This is a reply to one of our commands
-            self.enqueueReply(Reply(origin, msg))
+            self.enqueueReply(Reply(origin, msg, rxtime=rxtime))
 
         elif status is ReplyStatus.spont or status is ReplyStatus.spontadj:
             # Spontaneously generated event. We need to acknowledge.
@@ -328,7 +649,15 @@ class RecvThread(threading.Thread):
             if origin is None or not origin.isdigit():
                 return
             iorigin = int(origin)
-            self.comm.eventq.put((datetime.now(), iorigin, msg))
+            walltime = self.comm.wallTime(rxtime)
+            values = decodeVars(msg)
+            self.comm.history.addValues(iorigin, walltime, values)
+            if status is ReplyStatus.spont:
+                self.enqueueEvent(self.comm.eventq, Event(rxtime, walltime, iorigin, msg))
+            else:
+                # Adjusted variables are passed on decoded
+                event = AdjEvent(rxtime, walltime, iorigin, values)
+                self.enqueueEvent(self.comm.adjeventq, event)
 
     def run(self):
         insideNAKerr = False
@@ -336,6 +665,7 @@ class RecvThread(threading.Thread):
         while True:
             c = self.comm.read(1)
             if c == ENQ:
+                self.comm.markLink()
                 # Send keep-alive
                 self.comm.cmdq.put(DC4)
                 self.comm.allowNewCmd()
@@ -351,6 +681,7 @@ class RecvThread(threading.Thread):
                 pass
             elif c == STX:
                 # Start of command marker
+                self.__rxtime = time.monotonic_ns()
                 insideCommand = True
             elif c == ETX:
                 # End of command marker
@@ -391,15 +722,28 @@ DC4 = b'\x14'
 CHROK = [chr(c) for c in range(0x20 , 0x7E)]
 
 class Reply(object):
-    __slots__ = ('origin', 'value', 'error')
-    def __init__(self, origin=None, value='', error=False):
+    __slots__ = ('origin', 'value', 'error', 'rxtime')
+    def __init__(self, origin=None, value='', error=False, rxtime=None):
         self.origin = 0 if origin is None else int(origin)
         self.value = value
         self.error = error
+        # Monotonic reception time in ns, None if not received
+        self.rxtime = rxtime
 
     def __repr__(self):
         return "Fresenius Reply: Origin={}, Value={}, Error={}".format(self.origin, self.value, self.error)
 
+# Outcome of a stop command, latency in seconds since the frames were sent,
+# None if the stop was not confirmed
+StopResult = namedtuple('StopResult', ['confirmed', 'latency', 'error'])
+
+# Events are stamped with the monotonic time in ns at which the frame started
+# and with the corresponding wall clock time in ns since the epoch.
+# Spontaneous event carrying the raw message
+Event = namedtuple('Event', ['rxtime', 'walltime', 'origin', 'msg'])
+# Event carrying adjusted variables, decoded as {VarId: value}
+AdjEvent = namedtuple('AdjEvent', ['rxtime', 'walltime', 'origin', 'values'])
+
 class Command(Enum):
     connect      = b'DC'
     disconnect   = b'FC'
@@ -439,6 +783,14 @@ class VarId(Enum):
     nummods = b'i'
     modules = b'b'
 
+# Fixed point variables, number of decimals
+VARdecimals = {
+    VarId.rate    : 1, # ml/h
+    VarId.volume  : 3, # ml
+    VarId.bolrate : 1, # ml/h
+    VarId.bolvol  : 3  # ml
+}
+
 class FixedVarId(Enum):
     devicetype = b'b'
 
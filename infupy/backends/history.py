@@ -0,0 +1,119 @@
+import threading
+
+from array import array
+
+# Samples kept per syringe and variable, 4 hours at 1 Hz.
+# Each sample takes 16 bytes: int64 time in ns and float64 value.
+CAPACITY = 4 * 3600
+
+class RingBuffer(object):
+    # Fixed capacity columns of times and values, oldest samples get
+    # overwritten. Times are expected to be appended in increasing order.
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.times  = array('q', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.head  = 0 # next slot to write
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, t, v):
+        self.times[self.head] = t
+        self.values[self.head] = v
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def __slot(self, i):
+        # Physical slot of the i-th oldest sample
+        return (self.head - self.count + i) % self.capacity
+
+    def __slice(self, column, lo, hi):
+        # Samples lo to hi (oldest first) of a column
+        if lo >= hi:
+            return column[0:0]
+        a = self.__slot(lo)
+        b = self.__slot(hi - 1) + 1
+        if a < b:
+            return column[a:b]
+        return column[a:] + column[:b]
+
+    def __bisect(self, t):
+        # Index of the oldest sample with time >= t
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[self.__slot(mid)] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def window(self, start=None, end=None):
+        # Samples with start <= t < end, as (times, values) arrays.
+        # numpy.frombuffer() turns them into arrays without copying.
+        lo = 0 if start is None else self.__bisect(start)
+        hi = self.count if end is None else self.__bisect(end)
+        return self.__slice(self.times, lo, hi), self.__slice(self.values, lo, hi)
+
+    def downsample(self, interval, start=None, end=None):
+        # Mean value per interval (ns), stamped with the start of the interval
+        times, values = self.window(start, end)
+        rtimes, rvalues = array('q'), array('d')
+        if not times:
+            return rtimes, rvalues
+        origin = times[0] if start is None else start
+        bucket, total, n = None, 0., 0
+        for t, v in zip(times, values):
+            b = (t - origin) // interval
+            if b != bucket:
+                if n:
+                    rtimes.append(origin + bucket * interval)
+                    rvalues.append(total / n)
+                bucket, total, n = b, 0., 0
+            total += v
+            n += 1
+        rtimes.append(origin + bucket * interval)
+        rvalues.append(total / n)
+        return rtimes, rvalues
+
+
+class History(object):
+    # One RingBuffer per (syringe, variable), created on the first sample.
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.buffers = {}
+        self.__lock = threading.Lock()
+
+    def add(self, origin, varid, t, value):
+        with self.__lock:
+            key = (origin, varid)
+            if key not in self.buffers:
+                self.buffers[key] = RingBuffer(self.capacity)
+            self.buffers[key].append(t, value)
+
+    def addValues(self, origin, t, values):
+        # Decoded event values as {varid: value}
+        for varid, value in values.items():
+            self.add(origin, varid, t, value)
+
+    def keys(self):
+        with self.__lock:
+            return list(self.buffers.keys())
+
+    def window(self, origin, varid, start=None, end=None):
+        with self.__lock:
+            if (origin, varid) not in self.buffers:
+                return array('q'), array('d')
+            return self.buffers[(origin, varid)].window(start, end)
+
+    def downsample(self, origin, varid, interval, start=None, end=None):
+        with self.__lock:
+            if (origin, varid) not in self.buffers:
+                return array('q'), array('d')
+            return self.buffers[(origin, varid)].downsample(interval, start, end)
+
+    def nbytes(self):
+        with self.__lock:
+            return sum(b.capacity * 16 for b in self.buffers.values())
@@ -0,0 +1,113 @@
+from collections import deque, namedtuple
+
+# Rates in ml/h, volumes in ml, times in ns (e.g. Event.rxtime)
+NS_PER_HOUR = 3600e9
+
+# Outcome of an estimator update
+FlowEstimate = namedtuple('FlowEstimate', ['rate', 'variance', 'diverged'])
+
+class FlowEstimator(object):
+    # Least squares fit of the delivered volume over the last `window` events.
+    # Running sums make each update O(1). They get recomputed from the window
+    # once per `window` updates to keep rounding errors from building up.
+    def __init__(self, window=30, tolerance=0.1, mintolerance=0.1, nsigma=3):
+        self.window = window
+        self.tolerance = tolerance       # relative to the programmed rate
+        self.mintolerance = mintolerance # ml/h
+        self.nsigma = nsigma
+        self.programmed = None
+        self.resets = 0
+        self.reset()
+
+    def reset(self):
+        self.__samples = deque(maxlen=self.window)
+        self.__origin = None
+        self.__lastvolume = None
+        self.__sx = self.__sy = self.__sxx = self.__sxy = self.__syy = 0.
+        self.__updates = 0
+
+    def setProgrammedRate(self, rate):
+        # Rate as returned by readRate(), None if unknown
+        self.programmed = rate
+
+    def update(self, t, volume):
+        # Returns a FlowEstimate, or None until there are enough samples.
+        if self.__lastvolume is not None and volume < self.__lastvolume:
+            # The volume only goes down after resetVolume()
+            self.resets += 1
+            self.reset()
+        self.__lastvolume = volume
+
+        if self.__origin is None:
+            self.__origin = (t, volume)
+        x = (t - self.__origin[0]) / NS_PER_HOUR
+        y = volume - self.__origin[1]
+
+        if len(self.__samples) == self.window:
+            self.__accumulate(*self.__samples[0], sign=-1)
+        self.__samples.append((x, y))
+        self.__accumulate(x, y)
+
+        self.__updates += 1
+        if self.__updates >= self.window:
+            self.__rebase()
+
+        return self.estimate()
+
+    def estimate(self):
+        n = len(self.__samples)
+        if n < 3:
+            return None
+        sxx = self.__sxx - self.__sx ** 2 / n
+        sxy = self.__sxy - self.__sx * self.__sy / n
+        syy = self.__syy - self.__sy ** 2 / n
+        if sxx <= 0:
+            return None
+        rate = sxy / sxx
+        residual = max(syy - rate * sxy, 0.)
+        variance = residual / (n - 2) / sxx
+        return FlowEstimate(rate, variance, self.__diverged(rate, variance))
+
+    def __diverged(self, rate, variance):
+        if self.programmed is None:
+            return False
+        limit = max(self.tolerance * abs(self.programmed), self.mintolerance)
+        return abs(rate - self.programmed) > limit + self.nsigma * variance ** .5
+
+    def __accumulate(self, x, y, sign=1):
+        self.__sx  += sign * x
+        self.__sy  += sign * y
+        self.__sxx += sign * x * x
+        self.__sxy += sign * x * y
+        self.__syy += sign * y * y
+
+    def __rebase(self):
+        # Move the origin to the oldest sample and recompute the sums.
+        x0, y0 = self.__samples[0]
+        t0, v0 = self.__origin
+        self.__origin = (t0 + x0 * NS_PER_HOUR, v0 + y0)
+        samples = [(x - x0, y - y0) for x, y in self.__samples]
+        self.__samples.clear()
+        self.__sx = self.__sy = self.__sxx = self.__sxy = self.__syy = 0.
+        for x, y in samples:
+            self.__samples.append((x, y))
+            self.__accumulate(x, y)
+        self.__updates = 0
+
+
+class FlowMonitor(object):
+    # One FlowEstimator per syringe, created on the first event.
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.estimators = {}
+
+    def estimator(self, origin):
+        if origin not in self.estimators:
+            self.estimators[origin] = FlowEstimator(**self.kwargs)
+        return self.estimators[origin]
+
+    def update(self, origin, t, volume):
+        return self.estimator(origin).update(t, volume)
+
+    def setProgrammedRate(self, origin, rate):
+        self.estimator(origin).setProgrammedRate(rate)
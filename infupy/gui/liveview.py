@@ -0,0 +1,151 @@
+from qtpy import QtCore, QtGui, QtWidgets
+
+from infupy.flow import FlowMonitor
+
+# Maximum number of min/max buckets per series, about the screen width
+BUCKETS = 2048
+
+COLORS = [QtCore.Qt.blue, QtCore.Qt.red, QtCore.Qt.darkGreen, QtCore.Qt.magenta, QtCore.Qt.darkYellow]
+
+class DecimatedSeries(object):
+    # Min/max of the values in time buckets. Once the buckets are full,
+    # neighbours get merged and the bucket duration doubles, so memory
+    # and drawing cost stay bounded however long the recording lasts.
+    def __init__(self, t0, span=1., buckets=BUCKETS):
+        self.t0 = t0
+        self.span = span
+        self.buckets = buckets
+        self.mins = []
+        self.maxs = []
+        self.last = None
+        self.lastt = t0
+        self.vmin = self.vmax = None
+
+    def add(self, t, v):
+        b = int((t - self.t0) / self.span)
+        while b >= self.buckets:
+            self.__merge()
+            b = int((t - self.t0) / self.span)
+        b = max(b, 0)
+        if b >= len(self.mins):
+            # Empty buckets in between are gaps
+            gap = b - len(self.mins)
+            self.mins.extend([None] * gap + [v])
+            self.maxs.extend([None] * gap + [v])
+        elif self.mins[b] is None:
+            self.mins[b] = self.maxs[b] = v
+        else:
+            self.mins[b] = min(self.mins[b], v)
+            self.maxs[b] = max(self.maxs[b], v)
+        self.last = v
+        self.lastt = max(self.lastt, t)
+        self.vmin = v if self.vmin is None else min(self.vmin, v)
+        self.vmax = v if self.vmax is None else max(self.vmax, v)
+
+    def __merge(self):
+        def pairs(values, fn):
+            ret = []
+            for i in range(0, len(values), 2):
+                pair = [x for x in values[i:i + 2] if x is not None]
+                ret.append(fn(pair) if pair else None)
+            return ret
+        self.mins = pairs(self.mins, min)
+        self.maxs = pairs(self.maxs, max)
+        self.span *= 2
+
+    def points(self):
+        # (t, v) points going through the minimum and maximum of each bucket
+        for i, (lo, hi) in enumerate(zip(self.mins, self.maxs)):
+            if lo is None:
+                continue
+            t = self.t0 + (i + .5) * self.span
+            yield (t, lo)
+            if hi != lo:
+                yield (t, hi)
+
+
+class LiveView(QtWidgets.QWidget):
+    # Volume and estimated rate per syringe, repainted at most once per second.
+    sigValues = QtCore.Signal(int, float, object)
+
+    def __init__(self, parent=None):
+        super(LiveView, self).__init__(parent)
+        self.setMinimumHeight(200)
+        self.clear()
+
+        self.__dirty = False
+        self.__timer = QtCore.QTimer(self)
+        self.__timer.timeout.connect(self.__refresh)
+        self.__timer.start(1000)
+
+    def clear(self):
+        self.t0 = None
+        self.volumes = {}
+        self.rates = {}
+        self.flow = FlowMonitor()
+        self.update()
+
+    @QtCore.Slot(list)
+    def addEvents(self, events):
+        # (syringe, walltime ns, volume) tuples as sent by the recorder
+        latest = {}
+        for origin, walltime, volume in events:
+            t = walltime * 1e-9
+            if self.t0 is None:
+                self.t0 = t
+            if origin not in self.volumes:
+                self.volumes[origin] = DecimatedSeries(self.t0)
+                self.rates[origin] = DecimatedSeries(self.t0)
+            self.volumes[origin].add(t, volume)
+            estimate = self.flow.update(origin, walltime, volume)
+            if estimate is not None:
+                self.rates[origin].add(t, estimate.rate)
+            rate = None if estimate is None else estimate.rate
+            latest[origin] = (volume, rate)
+        for origin, (volume, rate) in latest.items():
+            self.sigValues.emit(origin, volume, rate)
+        self.__dirty = True
+
+    def __refresh(self):
+        if self.__dirty:
+            self.__dirty = False
+            self.update()
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtCore.Qt.white)
+        if self.t0 is not None:
+            half = self.rect().adjusted(2, 2, -2, -2)
+            half.setHeight(half.height() // 2)
+            self.__plot(painter, half, self.volumes, "ml")
+            half.translate(0, half.height())
+            self.__plot(painter, half, self.rates, "ml/h")
+        painter.end()
+
+    def __plot(self, painter, rect, series, unit):
+        filled = [s for s in series.values() if s.vmin is not None]
+        if not filled:
+            return
+        vmin = min(s.vmin for s in filled)
+        vmax = max(s.vmax for s in filled)
+        if vmax == vmin:
+            vmax = vmin + 1.
+        tmax = max(s.lastt for s in filled)
+        tspan = max(tmax - self.t0, 1.)
+
+        painter.setPen(QtCore.Qt.lightGray)
+        painter.drawRect(rect)
+        painter.setPen(QtCore.Qt.black)
+        painter.drawText(rect.adjusted(4, 2, 0, 0), QtCore.Qt.AlignLeft | QtCore.Qt.AlignTop,
+                         "{:.3g} {}".format(vmax, unit))
+        painter.drawText(rect.adjusted(4, 0, 0, -2), QtCore.Qt.AlignLeft | QtCore.Qt.AlignBottom,
+                         "{:.3g} {}".format(vmin, unit))
+
+        for origin, s in sorted(series.items()):
+            points = [QtCore.QPointF(rect.left() + (t - self.t0) / tspan * rect.width(),
+                                     rect.bottom() - (v - vmin) / (vmax - vmin) * rect.height())
+                      for t, v in s.points()]
+            if not points:
+                continue
+            painter.setPen(QtGui.QPen(QtGui.QColor(COLORS[(origin - 1) % len(COLORS)])))
+            painter.drawPolyline(QtGui.QPolygonF(points))
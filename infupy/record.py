@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+import sys, os.path, time, csv, io, queue, threading, argparse
+
+import infupy.backends.fresenius as fresenius
+
+DEBUG = False
+
+# Seconds between connection checks and between csv dumps
+CONN_INTERVAL = 5
+LOG_INTERVAL  = 1
+
+class Recorder(object):
+    def __init__(self, port="", destfolder=None, fileprefix=""):
+        self.oldconnstate = False
+        self.destfolder = os.path.expanduser("~") if destfolder is None else destfolder
+        self.fileprefix = fileprefix
+        self.port = port
+        self.conn = None
+        self.base = None
+        self.syringes = dict()
+        self.csvfd = io.IOBase()
+        self.csv = None
+        self.shouldrun = False
+
+    def start(self):
+        self.shouldrun = True
+
+    def stop(self):
+        self.shouldrun = False
+
+    # Hooks for the user interface
+    def report(self, err):
+        print("{}: {}".format(self.port, err), file=sys.stderr)
+
+    def notifyConnected(self):
+        pass
+
+    def notifyDisconnected(self):
+        pass
+
+    def notifySyringes(self, modids):
+        pass
+
+    def notifyEvents(self, events):
+        # Decoded events of one log loop as (syringe, walltime ns, volume) tuples
+        pass
+
+    def connectionLoop(self):
+        if not self.shouldrun:
+            self.onDisconnected()
+            return
+
+        if not self.checkSerial():
+            if not self.connectSerial():
+                return
+        if not self.checkBase():
+            if self.connectBase():
+                self.onConnected()
+            else:
+                self.onDisconnected()
+                return
+        self.checkSyringes()
+        self.attachNewSyringes()
+
+    def logLoop(self):
+        try: # Ensure file is open and writable.
+            if self.csvfd.closed or not self.csvfd.writable():
+                raise IOError("Not writable")
+        except (IOError, ValueError) as e:
+            if self.shouldrun:
+                self.report("File: {}".format(e))
+            return
+
+        events = []
+        while True: # Dump the whole queue to csv
+            try:
+                _, walltime, origin, msg = self.conn.eventq.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                volume = fresenius.extractVolume(msg)
+            except ValueError:
+                self.report("Failed to decode volume value")
+                continue
+
+            if DEBUG: print("{}:{}:{}".format(walltime, origin, volume), file=sys.stderr)
+
+            self.csv.writerow({'timestamp' : walltime,
+                               'syringe'   : origin,
+                               'volume'    : volume})
+            events.append((origin, walltime, volume))
+
+        if events:
+            self.notifyEvents(events)
+
+    def onConnected(self):
+        if self.oldconnstate == True:
+            if DEBUG: print("Already connected", file=sys.stderr)
+            return # already connected
+
+        self.csvfd.close()
+        if self.csvfd.closed or not self.csvfd.writable():
+            # We need to open a new file
+            self.csvfd.close()
+            filename = self.fileprefix + time.strftime('%Y%m%d-%H%M.csv')
+            filepath = os.path.join(self.destfolder, filename)
+            try:
+                self.csvfd = open(filepath, 'w', newline='')
+            except OSError as e:
+                # Go through the whole connection again on the next loop
+                self.report("Failed to open file: {}".format(e))
+                self.base = None
+                return
+            self.report("Opened file: {}".format(filepath))
+            self.csv = csv.DictWriter(self.csvfd, fieldnames = ['timestamp', 'syringe', 'volume'])
+            self.csv.writeheader()
+        self.oldconnstate = True
+        self.notifyConnected()
+
+    def onDisconnected(self):
+        if self.oldconnstate == False:
+            if DEBUG: print("Already disconnected", file=sys.stderr)
+            return # already disconnected
+
+        self.oldconnstate = False
+        self.notifyDisconnected()
+        # Clean up
+        self.syringes = dict()
+        self.base = None
+        self.notifySyringes([])
+        # Call once more to empty the queue
+        self.logLoop()
+        self.csvfd.close()
+        if not self.shouldrun and self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def checkSyringes(self):
+        for i, s in self.syringes.copy().items():
+            try:
+                s.checkAlive()
+            except Exception as e:
+                self.report("Syringe {} lost: {}".format(i, e))
+                del self.syringes[i]
+            # A reset syringe re-registers its events upon reconnection.
+
+    def attachNewSyringes(self):
+        try:
+            modids = self.base.listModules()
+            self.notifySyringes(modids)
+            newids = [modid for modid in modids if not modid in self.syringes.keys()]
+            if newids:
+                new = self.base.connectSyringes(newids, events=[fresenius.VarId.volume])
+                self.syringes.update(new)
+        except (IOError, fresenius.CommandError) as e:
+            self.report("Attach syringe error: {}".format(e))
+
+    def checkSerial(self):
+        if self.conn is None:
+            return False
+        try:
+            self.conn.name
+        except Exception as e:
+            self.report("Serial port exception: {}".format(e))
+            return False
+        else:
+            return True
+
+    def connectSerial(self):
+        try:
+            self.conn = fresenius.FreseniusComm(self.port)
+        except Exception as e:
+            self.report("Failed to open serial port: {}".format(e))
+            return False
+        else:
+            return True
+
+    def checkBase(self):
+        if self.base is None:
+            return False
+        try:
+            self.base.checkAlive()
+        except Exception as e:
+            self.report("Base error: {}".format(e))
+            return False
+        else:
+            return True
+
+    def connectBase(self):
+        try:
+            self.base = fresenius.FreseniusBase(self.conn)
+        except Exception as e:
+            self.report("Failed to connect to base: {}".format(e))
+            return False
+        else:
+            return True
+
+    def cleanup(self):
+        # Modules may be gone already, still release everything else.
+        for i, s in self.syringes.items():
+            try:
+                s.disconnect()
+            except Exception as e:
+                self.report("Failed to disconnect syringe {}: {}".format(i, e))
+        if self.base is not None:
+            try:
+                self.base.disconnect()
+            except Exception as e:
+                self.report("Failed to disconnect base: {}".format(e))
+        if self.conn is not None:
+            self.conn.close()
+        if self.csvfd is not None:
+            self.csvfd.close()
+
+    def serve(self, stopevent):
+        # Run the connection and log loops until stopevent is set.
+        # The first connection attempt happens right away.
+        self.start()
+        nextconn = time.monotonic()
+        while True:
+            # Unattended: report errors and try again on the next tick.
+            try:
+                if time.monotonic() >= nextconn:
+                    nextconn = time.monotonic() + CONN_INTERVAL
+                    self.connectionLoop()
+                if self.oldconnstate:
+                    self.logLoop()
+            except Exception as e:
+                self.report("Recorder error: {}".format(e))
+            if stopevent.wait(LOG_INTERVAL):
+                break
+        self.stop()
+        try:
+            self.logLoop()
+        except Exception as e:
+            self.report("Recorder error: {}".format(e))
+        self.cleanup()
+
+
+def portPrefix(port):
+    # Make a file name prefix out of a port name, e.g. /dev/ttyUSB0 -> ttyUSB0-
+    name = os.path.basename(port.rstrip('/\\')) or port
+    return "".join(c if c.isalnum() else '_' for c in name) + '-'
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m infupy.record',
+                                     description='Record Fresenius volume events to csv files.')
+    parser.add_argument('ports', nargs='+', help='serial ports to record from')
+    parser.add_argument('-d', '--folder', default=os.getcwd(), help='destination folder')
+    args = parser.parse_args(argv)
+
+    stopevent = threading.Event()
+    threads = []
+    prefixed = len(args.ports) > 1
+    for port in args.ports:
+        prefix = portPrefix(port) if prefixed else ""
+        recorder = Recorder(port, args.folder, fileprefix=prefix)
+        t = threading.Thread(target=recorder.serve, args=(stopevent,), daemon=True)
+        t.start()
+        threads.append(t)
+
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(LOG_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopevent.set()
+        for t in threads:
+            t.join()
+
+if __name__ == '__main__':
+    main()
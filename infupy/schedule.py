@@ -0,0 +1,118 @@
+import threading
+import time
+
+from collections import namedtuple
+
+import numpy as np
+
+from infupy.backends.common import printerr
+
+# Schedules are (times, rates) arrays: seconds from the start of the run
+# and rates in ml/h, each rate holding until the next time.
+
+# Outcome of one setRate call. scheduled, slip and latency are in seconds,
+# slip being the delay between the scheduled and the actual sending time
+# and latency the time the pump took to accept the command.
+DispatchRecord = namedtuple('DispatchRecord', ['pump', 'scheduled', 'rate', 'slip', 'latency', 'error'])
+
+def stepSchedule(times, rates):
+    times = np.asarray(times, dtype=float)
+    rates = np.asarray(rates, dtype=float)
+    if times.shape != rates.shape or times.ndim != 1:
+        raise ValueError("times and rates must be 1D arrays of the same length")
+    order = np.argsort(times, kind='stable')
+    return times[order], rates[order]
+
+def rampSchedule(start, stop, startrate, stoprate, step=10):
+    # Linear ramp from startrate to stoprate, updated every step seconds.
+    # The last update sets stoprate at stop.
+    times = np.append(np.arange(start, stop, step, dtype=float), float(stop))
+    rates = np.interp(times, [start, stop], [startrate, stoprate])
+    return times, rates
+
+def targetSchedule(times, targets, volume, ke, drugconc, maxrate=np.inf):
+    # Rates for a one compartment model to reach the target concentration
+    # at each of the given times.
+    # times: s, targets: mg/l, volume: l, ke: 1/min, drugconc: mg/ml, maxrate: ml/h
+    # Each interval assumes the previous target was reached. Clipped rates
+    # (below zero or above maxrate) make the model lag behind the targets.
+    # The last update holds the last target with the maintenance rate.
+    times = np.asarray(times, dtype=float)
+    targets = np.asarray(targets, dtype=float)
+    dt = np.diff(times) / 60.
+    decay = np.exp(-ke * dt)
+    # Drug input in mg/min bringing the model from one target to the next
+    dose = ke * volume * (targets[1:] - targets[:-1] * decay) / (1. - decay)
+    # Drug input in mg/min compensating the elimination at the last target
+    dose = np.append(dose, ke * volume * targets[-1])
+    rates = np.clip(dose / drugconc * 60., 0., maxrate)
+    return times, rates
+
+def dropRepeats(times, rates):
+    # Only keep rate changes to spare the bus
+    if len(rates) == 0:
+        return times, rates
+    keep = np.concatenate(([True], np.diff(rates) != 0))
+    return times[keep], rates[keep]
+
+
+class Dispatcher(object):
+    # Send setRate updates to several pumps according to their schedules.
+    # Pumps sharing a port are served by one thread in time order,
+    # different ports run in parallel.
+    def __init__(self):
+        self.schedules = []
+        self.records = []
+        self.__stopper = threading.Event()
+        self.__lock = threading.Lock()
+
+    def add(self, pump, times, rates):
+        times, rates = dropRepeats(*stepSchedule(times, rates))
+        self.schedules.append((pump, times, rates))
+
+    def stop(self):
+        self.__stopper.set()
+
+    def run(self, delay=0):
+        # Blocks until all schedules are done or stop() is called.
+        # Returns the DispatchRecords ordered by scheduled time.
+        self.__stopper.clear()
+        self.records = []
+        start = time.monotonic() + delay
+
+        byport = {}
+        for pump, times, rates in self.schedules:
+            byport.setdefault(id(pump.comm), []).append((pump, times, rates))
+
+        threads = [threading.Thread(target=self.__dispatch, args=(start, schedules))
+                   for schedules in byport.values()]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return sorted(self.records, key=lambda r: r.scheduled)
+
+    def __dispatch(self, start, schedules):
+        # Merge the schedules of one port into a single time ordered sequence.
+        times = np.concatenate([s[1] for s in schedules])
+        rates = np.concatenate([s[2] for s in schedules])
+        pumps = np.concatenate([np.full(len(s[1]), i) for i, s in enumerate(schedules)])
+        order = np.argsort(times, kind='stable')
+
+        for i in order:
+            scheduled = float(times[i])
+            if self.__stopper.wait(max(start + scheduled - time.monotonic(), 0)):
+                return
+            pump = schedules[pumps[i]][0]
+            rate = float(rates[i])
+            sent = time.monotonic()
+            error = None
+            try:
+                pump.setRate(rate)
+            except Exception as e:
+                printerr("Failed to set rate: {}", e)
+                error = e
+            record = DispatchRecord(pump, scheduled, rate, sent - start - scheduled,
+                                    time.monotonic() - sent, error)
+            with self.__lock:
+                self.records.append(record)
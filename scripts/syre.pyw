@@ -1,225 +1,81 @@
 #!/usr/bin/env python3
 
-import sys, os.path, time, csv, io, queue
+import sys, os.path
 
 from qtpy import QtCore, QtWidgets, QtWidgets
 
-import infupy.backends.fresenius as fresenius
+import infupy.record as record
 from infupy.gui.syringorecueil_ui import Ui_wndMain
+from infupy.gui.liveview import LiveView
 
 DEBUG = True
+record.DEBUG = DEBUG
+
+class WorkerRecorder(record.Recorder):
+    # Forward recorder notifications to the worker signals
+    def __init__(self, worker):
+        super(WorkerRecorder, self).__init__()
+        self.worker = worker
+
+    def report(self, err):
+        if DEBUG: print(err, file=sys.stderr)
+        self.worker.sigError.emit(str(err))
+
+    def notifyConnected(self):
+        self.worker.sigConnected.emit()
+        self.worker.logtimer.start(1000) # 1 second
+
+    def notifyDisconnected(self):
+        self.worker.sigDisconnected.emit()
+        self.worker.logtimer.stop()
+
+    def notifySyringes(self, modids):
+        self.worker.sigUpdateSyringes.emit(modids)
+
+    def notifyEvents(self, events):
+        self.worker.sigEvents.emit(events)
+
 
 class Worker(QtCore.QObject):
     sigConnected      = QtCore.Signal()
     sigDisconnected   = QtCore.Signal()
     sigUpdateSyringes = QtCore.Signal(list)
+    sigEvents         = QtCore.Signal(list)
     sigError          = QtCore.Signal(str)
 
     def __init__(self):
         super(Worker, self).__init__()
-        self.oldconnstate = False
-        self.destfolder = os.path.expanduser("~")
-        self.port = ""
-        self.conn = None
-        self.base = None
-        self.logger = None
-        self.syringes = dict()
-        self.csvfd = io.IOBase()
-        self.csv = None
-        self.shouldrun = False
+        self.recorder = WorkerRecorder(self)
 
         self.conntimer = QtCore.QTimer()
-        self.conntimer.timeout.connect(self.connectionLoop)
+        self.conntimer.timeout.connect(self.recorder.connectionLoop)
 
         self.logtimer = QtCore.QTimer()
-        self.logtimer.timeout.connect(self.logLoop)
+        self.logtimer.timeout.connect(self.recorder.logLoop)
 
         self.conntimer.start(5000) # 5 seconds
 
     @QtCore.Slot()
     def start(self):
-        self.shouldrun = True
+        self.recorder.start()
 
     @QtCore.Slot()
     def stop(self):
-        self.shouldrun = False
+        self.recorder.stop()
 
     @QtCore.Slot(str)
     def setport(self, port):
-        self.port = port
+        self.recorder.port = port
 
     @QtCore.Slot(str)
     def setfolder(self, folder):
-        self.destfolder = folder
-
-    def connectionLoop(self):
-        if not self.shouldrun:
-            self.onDisconnected()
-            return
-
-        if not self.checkSerial():
-            if not self.connectSerial():
-                return
-        if not self.checkBase():
-            if self.connectBase():
-                self.onConnected()
-            else:
-                self.onDisconnected()
-                return
-        self.checkSyringes()
-        self.attachNewSyringes()
-
-    def logLoop(self):
-        try: # Ensure file is open and writable.
-            if self.csvfd.closed or not self.csvfd.writable():
-                raise IOError("Not writable")
-        except (IOError, ValueError) as e:
-            if self.shouldrun:
-                self.reportUI("File: {}".format(e))
-            return
-
-        while True: # Dump the whole queue to csv
-            try:
-                dt, origin, msg = self.conn.eventq.get_nowait()
-            except queue.Empty:
-                break
-
-            try:
-                volume = fresenius.extractVolume(msg)
-            except ValueError:
-                self.reportUI("Failed to decode volume value")
-                continue
-
-            if DEBUG: print("{}:{}:{}".format(dt, origin, volume), file=sys.stderr)
-
-            timestamp = int(dt.timestamp() * 1e9)
-            self.csv.writerow({'timestamp' : timestamp,
-                               'syringe'   : origin,
-                               'volume'    : volume})
-
-    def onConnected(self):
-        if self.oldconnstate == True:
-            if DEBUG: print("Already connected", file=sys.stderr)
-            return # already connected
-
-        self.oldconnstate = True
-        self.sigConnected.emit()
-        self.csvfd.close()
-        if self.csvfd.closed or not self.csvfd.writable():
-            # We need to open a new file
-            self.csvfd.close()
-            filename = time.strftime('%Y%m%d-%H%M.csv')
-            filepath = os.path.join(self.destfolder, filename)
-            self.csvfd = open(filepath, 'w', newline='')
-            self.reportUI("Opened file: {}".format(filepath))
-            self.csv = csv.DictWriter(self.csvfd, fieldnames = ['timestamp', 'syringe', 'volume'])
-            self.csv.writeheader()
-        self.logtimer.start(1000) # 1 second
-
-    def onDisconnected(self):
-        if self.oldconnstate == False:
-            if DEBUG: print("Already disconnected", file=sys.stderr)
-            return # already disconnected
-
-        self.oldconnstate = False
-        self.sigDisconnected.emit()
-        # Clean up
-        self.syringes = dict()
-        self.base = None
-        self.sigUpdateSyringes.emit([])
-        # Stop csv logging
-        self.logtimer.stop()
-        # Call once more to empty the queue
-        self.logLoop()
-        self.csvfd.close()
-        if not self.shouldrun and self.conn is not None:
-            self.conn.close()
-            self.conn = None
-
-    def checkSyringes(self):
-        for i, s in self.syringes.copy().items():
-            try:
-                dtype = s.readDeviceType()
-                if DEBUG: print("Device: {}".format(dtype), file=sys.stderr)
-            except Exception as e:
-                self.reportUI("Syringe {} lost: {}".format(i, e))
-                del self.syringes[i]
-            else:
-                # Re-register volume event in case the syringe got reset.
-                try:
-                    s.registerEvent(fresenius.VarId.volume)
-                except fresenius.CommandError as e:
-                    self.reportUI("Register event error: {}".format(e))
-
-    def attachNewSyringes(self):
-        try:
-            modids = self.base.listModules()
-            self.sigUpdateSyringes.emit(modids)
-            for modid in modids:
-                if not modid in self.syringes.keys():
-                    s = fresenius.FreseniusSyringe(self.conn, modid)
-                    s.registerEvent(fresenius.VarId.volume)
-                    self.syringes[modid] = s
-        except (IOError, fresenius.CommandError) as e:
-            self.reportUI("Attach syringe error: {}".format(e))
-
-    def checkSerial(self):
-        if self.conn is None:
-            return False
-        try:
-            self.conn.name
-        except Exception as e:
-            self.reportUI("Serial port exception: {}".format(e))
-            return False
-        else:
-            return True
-
-    def connectSerial(self):
-        try:
-            self.conn = fresenius.FreseniusComm(self.port)
-        except Exception as e:
-            self.reportUI("Failed to open serial port: {}".format(e))
-            return False
-        else:
-            return True
-
-    def checkBase(self):
-        if self.base is None:
-            return False
-        try:
-            dtype = self.base.readDeviceType()
-            if DEBUG: print("Device: {}".format(dtype), file=sys.stderr)
-        except Exception as e:
-            self.reportUI("Base error: {}".format(e))
-            return False
-        else:
-            return True
-
-    def connectBase(self):
-        try:
-            self.base = fresenius.FreseniusBase(self.conn)
-        except Exception as e:
-            self.reportUI("Failed to connect to base: {}".format(e))
-            return False
-        else:
-            return True
-
-    def reportUI(self, err):
-        if DEBUG: print(err, file=sys.stderr)
-        self.sigError.emit(str(err))
+        self.recorder.destfolder = folder
 
     @QtCore.Slot()
     def cleanup(self):
         self.logtimer.stop()
         self.conntimer.stop()
-        for _, s in self.syringes.items():
-            s.disconnect()
-        if self.base is not None:
-            self.base.disconnect()
-        if self.conn is not None:
-            self.conn.close()
-        if self.csvfd is not None:
-            self.csvfd.close()
+        self.recorder.cleanup()
 
 
 class MainUi(QtWidgets.QMainWindow, Ui_wndMain):
@@ -234,6 +90,12 @@ class MainUi(QtWidgets.QMainWindow, Ui_wndMain):
         self.connStatusLabel.setMargin(2)
         self.statusBar.addPermanentWidget(self.connStatusLabel)
 
+        # Live volume and rate view below the syringe list
+        self.syringeItems = dict()
+        self.liveView = LiveView(self.centralwidget)
+        self.verticalLayout.addWidget(self.liveView)
+        self.resize(self.width(), self.height() + 300)
+
         # Init worker
         self.__workerthread = QtCore.QThread()
         self.__worker = Worker()
@@ -249,6 +111,8 @@ class MainUi(QtWidgets.QMainWindow, Ui_wndMain):
         self.__worker.sigConnected.connect(self.connected)
         self.__worker.sigDisconnected.connect(self.disconnected)
         self.__worker.sigUpdateSyringes.connect(self.updateSyringeList)
+        self.__worker.sigEvents.connect(self.liveView.addEvents)
+        self.liveView.sigValues.connect(self.updateSyringeValues)
         self.__worker.sigError.connect(self.showStatusError)
 
         self.__worker.moveToThread(self.__workerthread)
@@ -269,19 +133,35 @@ class MainUi(QtWidgets.QMainWindow, Ui_wndMain):
         self.statusBar.showMessage(errstr, 3000)
 
     def connected(self):
+        self.liveView.clear()
         self.connStatusLabel.setStyleSheet("QLabel{background : green;}")
         self.connStatusLabel.setText("Connected")
 
     def disconnected(self):
         self.lstSyringes.clear()
+        self.syringeItems = dict()
         self.connStatusLabel.setStyleSheet("QLabel{background : red;}")
         self.connStatusLabel.setText("Disconnected")
 
     def updateSyringeList(self, slist):
-        self.lstSyringes.clear()
-        for modid in slist:
-            liststr = "Seringue {}".format(modid)
-            self.lstSyringes.addItem(liststr)
+        # Only touch the items which changed
+        for modid in set(self.syringeItems) - set(slist):
+            item = self.syringeItems.pop(modid)
+            self.lstSyringes.takeItem(self.lstSyringes.row(item))
+        for modid in sorted(set(slist) - set(self.syringeItems)):
+            item = QtWidgets.QListWidgetItem("Seringue {}".format(modid))
+            row = len([i for i in self.syringeItems if i < modid])
+            self.lstSyringes.insertItem(row, item)
+            self.syringeItems[modid] = item
+
+    def updateSyringeValues(self, modid, volume, rate):
+        item = self.syringeItems.get(modid)
+        if item is None:
+            return
+        liststr = "Seringue {}: {:.3f} ml".format(modid, volume)
+        if rate is not None:
+            liststr += ", {:.1f} ml/h".format(rate)
+        item.setText(liststr)
 
     def closeEvent(self, event):
         # Wrap it all up
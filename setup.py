@@ -9,10 +9,13 @@ setup(name         = 'infupy',
       license      = 'ISC',
       packages     = ['infupy', 'infupy.backends', 'infupy.gui'],
       install_requires=[
-          'pyserial',
-          'crcmod',
-          'qtpy'
+          'pyserial'
       ],
+      extras_require={
+          'alaris'   : ['crcmod'],
+          'gui'      : ['qtpy'],
+          'schedule' : ['numpy']
+      },
       scripts = [
           'scripts/syre.pyw'
       ]
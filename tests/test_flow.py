@@ -0,0 +1,54 @@
+import unittest
+
+from infupy.flow import FlowEstimator, FlowMonitor
+
+NS = int(1e9)
+
+def feed(estimator, t0, v0, rate, n, dt=NS):
+    # n events at rate ml/h, one per dt ns, starting at (t0, v0)
+    estimate = None
+    for i in range(n):
+        t = t0 + i * dt
+        estimate = estimator.update(t, round(v0 + rate * i * dt / 3600e9, 3))
+    return estimate, t0 + n * dt
+
+class FlowEstimatorTest(unittest.TestCase):
+    def test_constant_rate(self):
+        e = FlowEstimator(window=30)
+        estimate, _ = feed(e, 0, 0., 10., 100)
+        self.assertAlmostEqual(estimate.rate, 10., delta=0.1)
+        self.assertFalse(estimate.diverged)
+
+    def test_needs_three_samples(self):
+        e = FlowEstimator()
+        self.assertIsNone(e.update(0, 0.))
+        self.assertIsNone(e.update(NS, 0.1))
+        self.assertIsNotNone(e.update(2 * NS, 0.2))
+
+    def test_reset_after_rebase(self):
+        # Enough events for the sums to be rebased before resetVolume
+        e = FlowEstimator(window=30)
+        _, t = feed(e, 0, 10., 3.6, 60)
+        self.assertIsNone(e.update(t, 0.06))
+        self.assertEqual(e.resets, 1)
+        estimate, _ = feed(e, t + NS, 0.061, 3.6, 10)
+        self.assertAlmostEqual(estimate.rate, 3.6, delta=0.2)
+
+    def test_divergence(self):
+        e = FlowEstimator(window=30)
+        e.setProgrammedRate(10.)
+        estimate, _ = feed(e, 0, 0., 5., 60)
+        self.assertTrue(estimate.diverged)
+        e.setProgrammedRate(5.)
+        self.assertFalse(e.estimate().diverged)
+
+    def test_monitor_per_syringe(self):
+        m = FlowMonitor(window=10)
+        for i in range(20):
+            m.update(1, i * NS, i * 10 / 3600)
+            m.update(2, i * NS, i * 20 / 3600)
+        self.assertAlmostEqual(m.estimator(1).estimate().rate, 10.)
+        self.assertAlmostEqual(m.estimator(2).estimate().rate, 20.)
+
+if __name__ == '__main__':
+    unittest.main()
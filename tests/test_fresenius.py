@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+import unittest
+
+try:
+    from infupy.backends import fresenius
+except ImportError:
+    fresenius = None
+
+if fresenius is not None:
+    class FakeComm(fresenius.FreseniusComm):
+        # Answers command frames of module i after delays[i] seconds,
+        # never if the delay is None.
+        def __init__(self, delays):
+            self.delays = delays
+            self.rx = queue.Queue()
+            self.written = []
+            super().__init__(None)
+
+        def read(self, size=1):
+            try:
+                return self.rx.get(timeout=.05)
+            except queue.Empty:
+                return b''
+
+        def write(self, data):
+            self.written.append(data)
+            if data[0:1] != fresenius.STX or not data[1:2].isdigit():
+                return len(data)
+            index = int(data[1:2])
+            delay = self.delays.get(index)
+            if delay is not None:
+                t = threading.Timer(delay, self.reply, args=(data[1:2],))
+                t.daemon = True
+                t.start()
+            return len(data)
+
+        def reply(self, origin):
+            for c in fresenius.genFrame(origin, b'C'):
+                self.rx.put(bytes([c]))
+
+def waitIdle(comm, timeout=1):
+    deadline = time.monotonic() + timeout
+    while comm.cmdq.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(.01)
+    return comm.cmdq.unfinished_tasks
+
+@unittest.skipIf(fresenius is None, "pyserial is not installed")
+class BatchTest(unittest.TestCase):
+    def frames(self, indices):
+        return {i: fresenius.genFrame(str(i).encode(), fresenius.Command.setpause.value)
+                for i in indices}
+
+    def test_replies_matched_by_origin(self):
+        comm = FakeComm({1: .01, 2: .03, 3: .02})
+        replies = comm.execRawBatch(self.frames([1, 2, 3]), timeout=.5)
+        self.assertEqual(sorted(replies), [1, 2, 3])
+        for origin, (reply, _) in replies.items():
+            self.assertEqual(reply.origin, origin)
+            self.assertFalse(reply.error)
+        self.assertEqual(waitIdle(comm), 0)
+
+    def test_late_reply_discarded(self):
+        comm = FakeComm({1: .01, 2: None, 3: .4})
+        replies = comm.execRawBatch(self.frames([1, 2, 3]), timeout=.2)
+        self.assertEqual(list(replies), [1])
+        # Module 3 answers after the deadline
+        time.sleep(.4)
+        self.assertTrue(comm.recvq.empty())
+        self.assertEqual(waitIdle(comm), 0)
+
+        # A later command to another module gets its own reply
+        s = fresenius.FreseniusSyringe(comm, 1, autoconnect=False)
+        reply = s.execCommand(fresenius.Command.setpause)
+        self.assertFalse(reply.error)
+        self.assertEqual(reply.origin, 1)
+
+@unittest.skipIf(fresenius is None, "pyserial is not installed")
+class EventQueueTest(unittest.TestCase):
+    def test_full_queue_drops_oldest(self):
+        comm = FakeComm({})
+        comm.eventq = queue.Queue(maxsize=2)
+        for i in range(5):
+            frame = fresenius.genFrame(b'1', b'E;r' + b'%X' % i)
+            for c in frame:
+                comm.rx.put(bytes([c]))
+        deadline = time.monotonic() + 1
+        while comm.droppedevents < 3 and time.monotonic() < deadline:
+            time.sleep(.01)
+        self.assertEqual(comm.droppedevents, 3)
+        volumes = [fresenius.extractVolume(comm.eventq.get_nowait().msg) for _ in range(2)]
+        self.assertEqual(volumes, [0.003, 0.004])
+        # The history keeps everything
+        self.assertEqual(len(comm.history.window(1, fresenius.VarId.volume)[0]), 5)
+
+@unittest.skipIf(fresenius is None, "pyserial is not installed")
+class StopAllTest(unittest.TestCase):
+    def base(self, delays):
+        comm = FakeComm(delays)
+        base = fresenius.FreseniusBase.__new__(fresenius.FreseniusBase)
+        fresenius.FreseniusModule.__init__(base, comm, 0, autoconnect=False)
+        base.syringes = {i: fresenius.FreseniusSyringe(comm, i, autoconnect=False)
+                         for i in delays}
+        return base
+
+    def test_only_acknowledged_confirmed(self):
+        base = self.base({1: .01, 2: None, 3: .3})
+        t = time.monotonic()
+        results = base.stopAll(timeout=.2, rounds=2)
+        self.assertLess(time.monotonic() - t, .5)
+        self.assertTrue(results[1].confirmed)
+        self.assertFalse(results[2].confirmed)
+        self.assertIsNone(results[2].latency)
+        # The late reply of the first round is no confirmation,
+        # the module gets confirmed only by its reply to the second round.
+        self.assertFalse(results[3].confirmed)
+        time.sleep(.4)
+        self.assertTrue(base.comm.recvq.empty())
+        self.assertEqual(waitIdle(base.comm), 0)
+
+if __name__ == '__main__':
+    unittest.main()
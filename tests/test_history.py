@@ -0,0 +1,44 @@
+import unittest
+
+from infupy.backends.history import RingBuffer, History
+
+class RingBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.r = RingBuffer(5)
+        for i in range(8):
+            self.r.append(i * 10, i * 1.5)
+
+    def test_keeps_latest(self):
+        times, values = self.r.window()
+        self.assertEqual(list(times), [30, 40, 50, 60, 70])
+        self.assertEqual(list(values), [4.5, 6., 7.5, 9., 10.5])
+        self.assertEqual(len(self.r), 5)
+
+    def test_window_across_wrap(self):
+        times, values = self.r.window(35, 65)
+        self.assertEqual(list(times), [40, 50, 60])
+        self.assertEqual(list(values), [6., 7.5, 9.])
+
+    def test_empty_window(self):
+        times, values = self.r.window(100)
+        self.assertEqual(len(times), 0)
+        self.assertEqual(len(values), 0)
+
+    def test_downsample(self):
+        times, values = self.r.downsample(20)
+        self.assertEqual(list(times), [30, 50, 70])
+        self.assertEqual(list(values), [5.25, 8.25, 10.5])
+
+class HistoryTest(unittest.TestCase):
+    def test_values_per_key(self):
+        h = History(capacity=10)
+        h.addValues(1, 5, {'r': 1., 'd': 2.})
+        h.addValues(2, 6, {'r': 3.})
+        self.assertEqual(sorted(h.keys()), [(1, 'd'), (1, 'r'), (2, 'r')])
+        self.assertEqual(list(h.window(1, 'r')[1]), [1.])
+        self.assertEqual(list(h.window(2, 'r')[0]), [6])
+        self.assertEqual(len(h.window(3, 'r')[0]), 0)
+        self.assertEqual(h.nbytes(), 3 * 10 * 16)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+try:
+    import numpy as np
+    from infupy import schedule
+except ImportError:
+    np = None
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class ScheduleTest(unittest.TestCase):
+    def test_ramp_ends_at_stoprate(self):
+        times, rates = schedule.rampSchedule(0, 100, 0., 10., step=10)
+        self.assertEqual(times[-1], 100.)
+        self.assertEqual(rates[-1], 10.)
+        self.assertEqual(rates[-2], 9.)
+
+    def test_step_sorted(self):
+        times, rates = schedule.stepSchedule([20, 0, 10], [3., 1., 2.])
+        self.assertEqual(list(times), [0., 10., 20.])
+        self.assertEqual(list(rates), [1., 2., 3.])
+
+    def test_drop_repeats(self):
+        times, rates = schedule.dropRepeats(np.array([0., 10., 20., 30.]),
+                                            np.array([1., 1., 2., 2.]))
+        self.assertEqual(list(times), [0., 20.])
+        self.assertEqual(list(rates), [1., 2.])
+
+    def test_target_holds_steady_state(self):
+        # At a constant target, the input compensates the elimination.
+        ke, volume, drugconc, target = .1, 10., 10., 2.
+        times, rates = schedule.targetSchedule([0, 60, 120], [target] * 3,
+                                               volume, ke, drugconc)
+        expected = ke * volume * target / drugconc * 60.
+        np.testing.assert_allclose(rates, expected)
+
+    def test_target_ends_with_maintenance(self):
+        # The loading rate must not keep running after the last target time
+        ke, volume, drugconc = .1, 10., 10.
+        times, rates = schedule.targetSchedule([0, 60], [0., 2.], volume, ke, drugconc)
+        self.assertEqual(list(times), [0., 60.])
+        self.assertAlmostEqual(rates[-1], ke * volume * 2. / drugconc * 60.)
+        self.assertGreater(rates[0], rates[-1])
+
+if __name__ == '__main__':
+    unittest.main()